@@ -1,4 +1,5 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, abort
+import click
 import sqlite3
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -10,9 +11,17 @@ from dotenv import load_dotenv
 from web3 import Web3
 from eth_account import Account
 import json
+import re
 from decimal import Decimal
 from cryptography.fernet import Fernet
 import secrets
+import threading
+import hashlib
+import gzip
+import mimetypes
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
@@ -32,6 +41,73 @@ fernet = Fernet(ENCRYPTION_KEY)
 # Configure Gemini AI
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-pro')
+
+# Prompt sizing: trips up to SINGLE_REQUEST_MAX_DAYS use one request, longer
+# trips are split into at most MAX_DAY_REQUESTS day-range requests (one day
+# each when the trip is short enough) that run in parallel
+SINGLE_REQUEST_MAX_DAYS = int(os.getenv('SINGLE_REQUEST_MAX_DAYS', 3))
+MAX_DAY_REQUESTS = int(os.getenv('MAX_DAY_REQUESTS', 10))
+OVERVIEW_OUTPUT_TOKENS = int(os.getenv('OVERVIEW_OUTPUT_TOKENS', 512))
+FOCUS_LINE_TOKENS = int(os.getenv('FOCUS_LINE_TOKENS', 32))
+DAY_OUTPUT_TOKENS = int(os.getenv('DAY_OUTPUT_TOKENS', 384))
+MAX_OUTPUT_TOKENS = int(os.getenv('MAX_OUTPUT_TOKENS', 2048))
+MAX_PARALLEL_REQUESTS = int(os.getenv('MAX_PARALLEL_REQUESTS', 6))
+
+# Day focus and day-range itinerary cache shared across requests
+DAY_PLAN_CACHE_SIZE = int(os.getenv('DAY_PLAN_CACHE_SIZE', 256))
+day_plan_cache = OrderedDict()
+day_plan_cache_lock = threading.Lock()
+
+# Static asset pipeline: `flask build-assets` writes fingerprinted copies of
+# static/ into static/dist along with a manifest mapping original names to them.
+# Files from earlier builds stay servable until `flask prune-assets` removes them
+ASSET_DIST_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_MANIFEST = os.path.join(ASSET_DIST_DIR, 'manifest.json')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+HERO_IMAGE_WIDTHS = (640, 1280, 1920)
+
+
+asset_manifest = {'mtime': None, 'entries': {}, 'files': set(), 'variants': {}}
+
+
+def load_asset_manifest():
+    # Reload whenever the manifest changes so a rebuild takes effect without a restart
+    try:
+        mtime = os.path.getmtime(ASSET_MANIFEST)
+    except OSError:
+        mtime = None
+
+    if mtime != asset_manifest['mtime']:
+        try:
+            with open(ASSET_MANIFEST) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        entries = data.get('assets', {})
+
+        # Responsive WebP variants keyed by the stem of the source image
+        variants = {}
+        for name, hashed_name in entries.items():
+            match = re.fullmatch(r'(.+)-(\d+)\.webp', name)
+            if match:
+                variants.setdefault(match.group(1), []).append((int(match.group(2)), hashed_name))
+
+        asset_manifest.update(
+            mtime=mtime,
+            entries=entries,
+            files=set(data.get('files', [])) | set(entries.values()),
+            variants={stem: sorted(widths) for stem, widths in variants.items()}
+        )
+    return asset_manifest
+
+
+def write_asset_manifest(entries, files):
+    # Write then rename so a running server never reads a half-written manifest
+    tmp_path = ASSET_MANIFEST + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'assets': entries, 'files': sorted(files)}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, ASSET_MANIFEST)
+
 # Smart Contract ABI
 CONTRACT_ABI = [
     {
@@ -136,29 +212,183 @@ class AITravelPlanner:
         except Exception:
             return None
 
-    def generate_ai_recommendations(self, location, interests, budget, duration, weather):
-        prompt = f"""
-        As a travel expert, create a detailed travel plan for {location} with the following details:
-        - Duration: {duration} days
-        - Budget: USD {budget}
-        - Interests: {', '.join(interests)}
-        - Current Weather: {weather}
-        
-        Please provide:
-        1. Day-by-day itinerary
-        2. Estimated costs for each activity
-        3. Local transportation options
-        4. Student-friendly recommendations
-        5. Must-visit locations
-        6. Local food recommendations
-        7. Safety tips
-        8. Time management suggestions
-        """
+    def _max_output_tokens(self, days):
+        # Size the output limit to the number of days the response has to cover
+        return min(OVERVIEW_OUTPUT_TOKENS + DAY_OUTPUT_TOKENS * days, MAX_OUTPUT_TOKENS)
+
+    def _day_chunks(self, duration):
+        # Group days so a plan never sends more than MAX_DAY_REQUESTS day requests
+        size = -(-duration // MAX_DAY_REQUESTS)
+        return [(start, min(start + size - 1, duration)) for start in range(1, duration + 1, size)]
+
+    def _chunk_label(self, start, end):
+        return f"Day {start}" if start == end else f"Days {start}-{end}"
+
+    def _trip_key(self, location, interests, budget, duration):
+        # Only stable inputs, so repeated plans for the same trip hit the cache
+        return (
+            location.strip().lower(),
+            tuple(sorted(interest.lower() for interest in interests)),
+            duration,
+            round(budget / duration)
+        )
+
+    def _cache_get(self, key):
+        with day_plan_cache_lock:
+            value = day_plan_cache.get(key)
+            if value is not None:
+                day_plan_cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key, value):
+        with day_plan_cache_lock:
+            day_plan_cache[key] = value
+            if len(day_plan_cache) > DAY_PLAN_CACHE_SIZE:
+                day_plan_cache.popitem(last=False)
+
+    def _build_prompt(self, location, interests, budget, duration, weather, include_itinerary=True, focus_chunks=()):
+        sections = [
+            "Local transportation options",
+            "Must-visit locations",
+            "Local food recommendations",
+            "Safety tips"
+        ]
+        if include_itinerary:
+            sections.insert(0, "Day-by-day itinerary with estimated costs")
+        elif focus_chunks:
+            # Listed first so a truncated response still carries every day's focus
+            lines = ", ".join(f"'{self._chunk_label(start, end)}: <area or theme>'" for start, end in focus_chunks)
+            sections.insert(0, f"Day focus: one line each for {lines}, every line a different area or theme with no repeated attractions")
+
+        prompt = (
+            f"Travel plan for {location}: {duration} days, budget USD {budget}, "
+            f"interests: {', '.join(interests) or 'general'}, weather: {weather}. "
+            "Student-friendly, concise. Sections: " + "; ".join(sections) + ". "
+            "Give each section a one-line title, separate sections with a blank line."
+        )
+        return prompt
+
+    def _build_days_prompt(self, location, interests, budget, duration, start, end, focus):
+        label = self._chunk_label(start, end)
+        prompt = (
+            f"{label} of a {duration}-day trip to {location}, focus only on: {focus}. "
+            f"Budget USD {round(budget / duration, 2)} per day, "
+            f"interests: {', '.join(interests) or 'general'}. "
+            f"Concise student-friendly itinerary with estimated costs and timings for each day. "
+            f"Start with the title '{label}: {focus}' on its own line, no blank lines."
+        )
+        return prompt
+
+    def _day_focus(self, overview, location, interests, chunks):
+        """Return ({start_day: focus}, complete) parsed from the overview's Day focus lines."""
+        starts = {start for start, end in chunks}
+        focus = {}
+        for match in re.finditer(r'Days?\s+(\d+)(?:\s*-\s*\d+)?\s*:\s*(.+)', overview or ''):
+            start = int(match.group(1))
+            if start in starts and start not in focus:
+                focus[start] = match.group(2).strip(' *')
+        complete = len(focus) == len(chunks)
+
+        # Fall back to rotating interests across distinct parts of the city
+        themes = interests or ['sightseeing']
+        for index, (start, end) in enumerate(chunks):
+            if start not in focus:
+                focus[start] = f"{themes[index % len(themes)]} in area {index + 1} of {location}, distinct from other days"
+        return focus, complete
+
+    def _generate(self, prompt, max_output_tokens):
         try:
-            response = model.generate_content(prompt)
-            return response.text
+            response = model.generate_content(
+                prompt,
+                generation_config={'max_output_tokens': max_output_tokens}
+            )
         except Exception:
-            return None
+            return {'text': None, 'input_tokens': 0, 'output_tokens': 0}
+
+        usage = getattr(response, 'usage_metadata', None)
+        try:
+            text = response.text.strip()
+        except Exception:
+            # Blocked or empty candidates still bill the tokens in usage_metadata
+            text = None
+        return {
+            'text': text,
+            'input_tokens': getattr(usage, 'prompt_token_count', 0) or 0,
+            'output_tokens': getattr(usage, 'candidates_token_count', 0) or 0
+        }
+
+    def _generate_days(self, location, interests, budget, duration, start, end, focus, trip_key):
+        cache_key = (trip_key, start, end, focus)
+        cached = self._cache_get(cache_key)
+        if cached:
+            # Cached days cost no tokens for this plan
+            return {'text': cached, 'input_tokens': 0, 'output_tokens': 0}
+
+        result = self._generate(
+            self._build_days_prompt(location, interests, budget, duration, start, end, focus),
+            min(DAY_OUTPUT_TOKENS * (end - start + 1), MAX_OUTPUT_TOKENS)
+        )
+        if result['text']:
+            self._cache_put(cache_key, result['text'])
+        else:
+            # Keep the rest of the plan when a single day range fails
+            result['text'] = (
+                f"{self._chunk_label(start, end)}: {focus}\n"
+                "This part of the trip could not be generated, please plan it on arrival."
+            )
+            result['failed'] = True
+        return result
+
+    def generate_ai_recommendations(self, location, interests, budget, duration, weather):
+        """Return (recommendations, token_usage); recommendations is None on failure."""
+        if duration <= SINGLE_REQUEST_MAX_DAYS:
+            results = [self._generate(
+                self._build_prompt(location, interests, budget, duration, weather),
+                self._max_output_tokens(duration)
+            )]
+        else:
+            trip_key = self._trip_key(location, interests, budget, duration)
+            chunks = self._day_chunks(duration)
+            focus = self._cache_get((trip_key, 'focus'))
+            overview_prompt = self._build_prompt(
+                location, interests, budget, duration, weather,
+                include_itinerary=False, focus_chunks=() if focus else chunks
+            )
+            overview_tokens = min(
+                OVERVIEW_OUTPUT_TOKENS + (0 if focus else FOCUS_LINE_TOKENS * len(chunks)),
+                MAX_OUTPUT_TOKENS
+            )
+
+            with ThreadPoolExecutor(max_workers=min(len(chunks) + 1, MAX_PARALLEL_REQUESTS)) as executor:
+                overview = None
+                if focus:
+                    # Day focus is cached, so the overview can run alongside the days
+                    overview = executor.submit(self._generate, overview_prompt, overview_tokens)
+                else:
+                    # The overview assigns each day range its own focus before the days run
+                    overview_result = self._generate(overview_prompt, overview_tokens)
+                    focus, complete = self._day_focus(overview_result['text'], location, interests, chunks)
+                    if complete:
+                        self._cache_put((trip_key, 'focus'), focus)
+
+                days = [
+                    executor.submit(
+                        self._generate_days, location, interests, budget, duration,
+                        start, end, focus[start], trip_key
+                    )
+                    for start, end in chunks
+                ]
+                if overview:
+                    overview_result = overview.result()
+                results = [overview_result] + [day.result() for day in days]
+
+        token_usage = {
+            'input_tokens': sum(result['input_tokens'] for result in results),
+            'output_tokens': sum(result['output_tokens'] for result in results)
+        }
+        if all(not result['text'] or result.get('failed') for result in results):
+            return None, token_usage
+        return '\n\n'.join(result['text'] for result in results if result['text']), token_usage
 
 def init_db():
     conn = sqlite3.connect('travel_companion.db')
@@ -206,11 +436,20 @@ def init_db():
             status TEXT,
             weather_info TEXT,
             recommendations TEXT,
+            input_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER DEFAULT 0,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
     
+    # Add token usage columns to existing travel_plans tables
+    c.execute("PRAGMA table_info(travel_plans)")
+    plan_columns = [row[1] for row in c.fetchall()]
+    for column in ('input_tokens', 'output_tokens'):
+        if column not in plan_columns:
+            c.execute(f"ALTER TABLE travel_plans ADD COLUMN {column} INTEGER DEFAULT 0")
+    
     conn.commit()
     conn.close()
 
@@ -219,6 +458,10 @@ def get_db():
     conn = sqlite3.connect('travel_companion.db')
     conn.row_factory = sqlite3.Row
     return conn
+
+# Create tables and add new columns whenever the app is loaded
+init_db()
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -378,11 +621,15 @@ def plan_trip():
             weather_desc = weather_data['weather'][0]['description']
             temp = weather_data['main']['temp']
 
-        recommendations = planner.generate_ai_recommendations(
+        recommendations, token_usage = planner.generate_ai_recommendations(
             destination, interests, budget, duration, weather_desc
         )
 
         if not recommendations:
+            app.logger.warning(
+                f"Travel plan for {destination} failed after using "
+                f"{token_usage['input_tokens']} input / {token_usage['output_tokens']} output tokens"
+            )
             flash("Failed to generate travel recommendations")
             return render_template("layout.html")
 
@@ -394,12 +641,13 @@ def plan_trip():
                 INSERT INTO travel_plans (
                     user_id, destination, journey_date, duration, 
                     budget, status, weather_info, recommendations,
-                    created_at, updated_at
+                    input_tokens, output_tokens, created_at, updated_at
                 )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 session['user_id'], destination, journey_date, duration,
                 budget, 'planned', json.dumps(weather_data), recommendations,
+                token_usage['input_tokens'], token_usage['output_tokens'],
                 current_time, current_time
             ))
             conn.commit()
@@ -638,6 +886,114 @@ def logout():
     
     return redirect(url_for('home'))
 
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    # Only fingerprinted files are served here, and they never change
+    if filename not in load_asset_manifest()['files']:
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] > 0 and os.path.isfile(os.path.join(ASSET_DIST_DIR, filename + suffix)):
+            response = send_from_directory(ASSET_DIST_DIR, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(ASSET_DIST_DIR, filename, mimetype=mimetype)
+
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint, precompress and write responsive variants of static assets."""
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+        click.echo("Pillow not installed - skipping WebP hero image variants")
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        click.echo("brotli not installed - skipping .br files")
+
+    def write_asset(name, data):
+        stem, ext = os.path.splitext(name)
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        hashed_name = f"{stem}.{digest}{ext}"
+        path = os.path.join(ASSET_DIST_DIR, hashed_name)
+        manifest[name] = hashed_name
+        if os.path.exists(path):
+            # Same content as an earlier build
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            compressed = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli:
+                compressed.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, payload in compressed:
+                # Only keep encodings that actually save bytes
+                if len(payload) < len(data):
+                    with open(path + suffix, 'wb') as f:
+                        f.write(payload)
+
+    # Earlier builds are kept so pages already sent to browsers keep working
+    previous_files = load_asset_manifest()['files']
+
+    manifest = {}
+    for root, dirs, files in os.walk(app.static_folder):
+        if root == app.static_folder and 'dist' in dirs:
+            dirs.remove('dist')
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                write_asset(name, f.read())
+
+            if Image and name.startswith('images/hero-') and name.endswith('.jpg'):
+                with Image.open(path) as image:
+                    # Images narrower than every configured width still get one variant
+                    widths = [width for width in HERO_IMAGE_WIDTHS if width <= image.width] or [image.width]
+                    for width in widths:
+                        height = round(image.height * width / image.width)
+                        buffer = BytesIO()
+                        image.resize((width, height), Image.LANCZOS).save(buffer, 'WEBP', quality=80, method=6)
+                        write_asset(f"{name[:-4]}-{width}.webp", buffer.getvalue())
+
+    kept_files = {name for name in previous_files if os.path.isfile(os.path.join(ASSET_DIST_DIR, name))}
+    write_asset_manifest(manifest, kept_files | set(manifest.values()))
+
+    click.echo(f"Built {len(manifest)} assets into {ASSET_DIST_DIR}")
+
+@app.cli.command('prune-assets')
+def prune_assets():
+    """Delete fingerprinted assets that are not part of the latest build."""
+    current = load_asset_manifest()
+    current_files = set(current['entries'].values())
+
+    removed = 0
+    for root, dirs, files in os.walk(ASSET_DIST_DIR):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, ASSET_DIST_DIR).replace(os.sep, '/')
+            if name == os.path.basename(ASSET_MANIFEST):
+                continue
+            for suffix in ('.gz', '.br'):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if name not in current_files:
+                os.remove(path)
+                removed += 1
+
+    write_asset_manifest(current['entries'], current_files)
+    click.echo(f"Removed {removed} old asset files from {ASSET_DIST_DIR}")
+
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
@@ -655,12 +1011,21 @@ def utility_processor():
             dt = datetime.strptime(dt, '%Y-%m-%d %H:%M:%S')
         return dt.strftime('%Y-%m-%d %H:%M:%S')
     
-    return dict(format_datetime=format_datetime)
+    def asset_url(filename):
+        # Fall back to the raw static file when assets have not been built
+        manifest = load_asset_manifest()['entries']
+        if filename in manifest:
+            return url_for('assets', filename=manifest[filename])
+        return url_for('static', filename=filename)
+    
+    def asset_srcset(filename):
+        # Built WebP variants of an image as a srcset, empty when none were built
+        variants = load_asset_manifest()['variants'].get(os.path.splitext(filename)[0], [])
+        return ', '.join(f"{url_for('assets', filename=hashed_name)} {width}w" for width, hashed_name in variants)
+    
+    return dict(format_datetime=format_datetime, asset_url=asset_url, asset_srcset=asset_srcset)
 
 if __name__ == '__main__':
-    # Initialize database
-    init_db()
-    
     # Set up logging (optional)
     if not app.debug:
         import logging